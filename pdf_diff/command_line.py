@@ -12,6 +12,14 @@ from PIL import Image, ImageDraw, ImageOps
 if sys.version_info[0] < 3:
     sys.exit("ERROR: Python version 3+ is required.")
 
+try:
+    from pdf_diff.page_cache import PageImageCache
+except ModuleNotFoundError as e:
+    # Running this file directly as a script.
+    if e.name != "pdf_diff":
+        raise
+    from page_cache import PageImageCache
+
 
 def compute_changes(pdf1_opts, pdf2_opts, **kwargs):
     # Serialize the text in the two PDFs.
@@ -252,7 +260,7 @@ def mark_difference(hunk_length, offset, boxes, changes):
 # Turns a JSON object of PDF changes into a PIL image object.
 
 
-def render_changes(changes, styles, width):
+def render_changes(changes, styles, width, cache=None):
         # Merge sequential boxes to avoid sequential disjoint rectangles.
 
     changes = simplify_changes(changes)
@@ -261,7 +269,7 @@ def render_changes(changes, styles, width):
 
     # Make images for all of the pages named in changes.
 
-    pages = make_pages_images(changes, width)
+    pages = make_pages_images(changes, width, cache)
 
     # Convert the box coordinates (PDF coordinates) into image coordinates.
     # Then set change["page"] = change["page"]["number"] so that we don't
@@ -301,7 +309,9 @@ def render_changes(changes, styles, width):
     return img
 
 
-def make_pages_images(changes, width):
+def make_pages_images(changes, width, cache=None):
+    # Rasterize the changed pages, reusing them from cache (a
+    # PageImageCache) if one is given. Without one nothing is kept.
     pages = [{}, {}]
     for change in changes:
         if change == "*":
@@ -309,8 +319,12 @@ def make_pages_images(changes, width):
         pdf_index = change["pdf"]["index"]
         pdf_page = change["page"]["number"]
         if pdf_page not in pages[pdf_index]:
-            pages[pdf_index][pdf_page] = pdftopng(
-                change["pdf"]["file"], pdf_page, width)
+            if cache is None:
+                pages[pdf_index][pdf_page] = pdftopng(
+                    change["pdf"]["file"], pdf_page, width)
+            else:
+                pages[pdf_index][pdf_page] = cache.get(
+                    change["pdf"]["file"], pdf_page, width, pdftopng)
     return pages
 
 
@@ -590,6 +604,10 @@ def main():
                         help='bottom margin (ignored area) begin in percent of page height (default 100.0)')
     parser.add_argument('-r', '--result-width', default=900, type=int,
                         help='width of the result image (width of image in px)')
+    parser.add_argument('--cache-dir', metavar='dir',
+                        help='directory in which to keep rasterized pages for reuse by later runs')
+    parser.add_argument('--cache-size', metavar='MB', default=1024, type=int,
+                        help='maximum size of the --cache-dir directory in megabytes (default 1024)')
     args = parser.parse_args()
 
     def invalid_usage(msg):
@@ -612,9 +630,20 @@ def main():
         invalid_usage(
             'Please specify files to compare, or use --changes option.')
 
+    if args.cache_size <= 0:
+        invalid_usage('--cache-size must be a positive number of megabytes.')
+
+    # Within one run make_pages_images already rasterizes each page once,
+    # so a cache only pays off when it persists to disk.
+    cache = None
+    if args.cache_dir is not None:
+        cache = PageImageCache(disk_dir=args.cache_dir,
+                               disk_limit=args.cache_size * 1024 * 1024)
+
     if args.changes:
         # to just do the rendering part
-        img = render_changes(json.load(sys.stdin), style, args.result_width)
+        img = render_changes(json.load(sys.stdin), style, args.result_width,
+                             cache)
         img.save(sys.stdout.buffer, args.format.upper())
         sys.exit(0)
 
@@ -636,7 +665,7 @@ def main():
         },
         top_margin=float(args.top_margin),
         bottom_margin=float(args.bottom_margin))
-    img = render_changes(changes, style, args.result_width)
+    img = render_changes(changes, style, args.result_width, cache)
     img.save(sys.stdout.buffer, args.format.upper())
 
 
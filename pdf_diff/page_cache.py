@@ -0,0 +1,244 @@
+import collections
+import hashlib
+import os
+import struct
+import time
+import uuid
+
+from PIL import Image
+
+# Cache of rasterized PDF pages, keyed by (hash of the PDF's bytes, page
+# number, width). Pages live in an in-memory LRU and, optionally, in a
+# directory on disk as raw pixel data, which loads much faster than PNG.
+
+DEFAULT_MEMORY_LIMIT = 256 * 1024 * 1024
+DEFAULT_DISK_LIMIT = 1024 * 1024 * 1024
+
+# On-disk header: magic, image mode (space padded), width, height.
+RAW_HEADER = struct.Struct("<4s4sII")
+RAW_MAGIC = b"PDPC"
+RAW_SUFFIX = ".raw"
+TMP_SUFFIX = ".tmp"
+
+# Temporary files older than this were left behind by a process that died
+# mid-write and can be removed.
+STALE_TMP_AGE = 10 * 60
+
+# When the on-disk tier goes over its limit, evict down to this fraction
+# of the limit so that we don't rescan the directory on every write.
+DISK_LOW_WATER = 0.9
+
+# How many file hashes to remember.
+HASH_MEMO_SIZE = 128
+
+
+def file_hash(fn):
+    """Return the SHA-256 hex digest of the contents of a file."""
+    h = hashlib.sha256()
+    with open(fn, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def image_nbytes(im):
+    return im.size[0] * im.size[1] * len(im.getbands())
+
+
+class PageImageCache:
+    def __init__(self, memory_limit=DEFAULT_MEMORY_LIMIT,
+                 disk_dir=None, disk_limit=DEFAULT_DISK_LIMIT):
+        self.memory_limit = memory_limit
+        self.disk_dir = disk_dir
+        self.disk_limit = disk_limit
+        self._memory = collections.OrderedDict()
+        self._memory_size = 0
+        # Maps a path to (stat stamp, hash) so we don't re-hash a file
+        # that hasn't changed. Least recently used paths are forgotten.
+        self._hashes = collections.OrderedDict()
+        self._disk_size = 0
+        if disk_dir is not None:
+            # If the directory can't be created, every disk lookup will
+            # simply miss.
+            try:
+                os.makedirs(disk_dir, exist_ok=True)
+            except OSError:
+                pass
+            self._disk_size = self._disk_scan()[1]
+
+    def get(self, pdffile, pagenumber, width, render):
+        """Return the image of a page, calling render(pdffile, pagenumber,
+        width) only if it isn't in either tier of the cache. The caller
+        gets its own copy, so it may draw on it freely."""
+        key = (self._hash(pdffile), pagenumber, width)
+
+        im = self._memory_get(key)
+        if im is None:
+            im = self._disk_get(key)
+            if im is None:
+                im = render(pdffile, pagenumber, width)
+                self._disk_put(key, im)
+            self._memory_put(key, im)
+
+        return im.copy()
+
+    def clear(self):
+        """Empty the in-memory tier. The on-disk tier is left alone."""
+        self._memory.clear()
+        self._memory_size = 0
+
+    def _hash(self, fn):
+        st = os.stat(fn)
+        stamp = (st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns)
+        cached = self._hashes.get(fn)
+        if cached is not None and cached[0] == stamp:
+            self._hashes.move_to_end(fn)
+            return cached[1]
+        digest = file_hash(fn)
+        self._hashes[fn] = (stamp, digest)
+        self._hashes.move_to_end(fn)
+        while len(self._hashes) > HASH_MEMO_SIZE:
+            self._hashes.popitem(last=False)
+        return digest
+
+    # In-memory tier.
+
+    def _memory_get(self, key):
+        im = self._memory.get(key)
+        if im is not None:
+            self._memory.move_to_end(key)
+        return im
+
+    def _memory_put(self, key, im):
+        size = image_nbytes(im)
+        if size > self.memory_limit:
+            return
+        self._memory[key] = im
+        self._memory_size += size
+        while self._memory_size > self.memory_limit:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= image_nbytes(evicted)
+
+    # On-disk tier.
+
+    def _disk_path(self, key):
+        digest, pagenumber, width = key
+        return os.path.join(self.disk_dir, "%s-%d-%d%s" % (
+            digest, pagenumber, width, RAW_SUFFIX))
+
+    def _disk_get(self, key):
+        if self.disk_dir is None:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        if len(data) < RAW_HEADER.size:
+            return None
+        magic, mode, w, h = RAW_HEADER.unpack_from(data)
+        if magic != RAW_MAGIC:
+            return None
+        try:
+            im = Image.frombytes(mode.decode("ascii").strip(), (w, h),
+                                 data[RAW_HEADER.size:])
+        except ValueError:
+            # Truncated or otherwise corrupt entry. Re-render it.
+            return None
+        # Mark it as recently used so that it's evicted last.
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return im
+
+    def _disk_put(self, key, im):
+        if self.disk_dir is None:
+            return
+        header = RAW_HEADER.pack(RAW_MAGIC, im.mode.ljust(4).encode("ascii"),
+                                 im.size[0], im.size[1])
+        if len(header) + image_nbytes(im) > self.disk_limit:
+            return
+
+        # Write to a temporary file and rename it into place so that a
+        # concurrent reader never sees a partial entry.
+        path = self._disk_path(key)
+        size = len(header) + image_nbytes(im)
+        # Unlike mkstemp, os.open applies the umask to the mode, so the
+        # entry gets the same permissions as any other file we'd create.
+        tmp = os.path.join(self.disk_dir, uuid.uuid4().hex + TMP_SUFFIX)
+        created = replaced = False
+        try:
+            fd = os.open(tmp, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666)
+            created = True
+            with os.fdopen(fd, "wb") as f:
+                f.write(header)
+                f.write(im.tobytes())
+            try:
+                # We only get here on a miss, but a corrupt entry may
+                # already be in the way.
+                old_size = os.stat(path).st_size
+            except OSError:
+                old_size = 0
+            os.replace(tmp, path)
+            replaced = True
+        except OSError:
+            return
+        finally:
+            if created and not replaced:
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
+
+        self._disk_size += size - old_size
+        if self._disk_size > self.disk_limit:
+            self._disk_evict(path)
+
+    def _disk_scan(self):
+        # Return the cache entries as (mtime, size, path) and their total
+        # size. Stale temporary files are removed along the way.
+        entries = []
+        total = 0
+        stale = time.time() - STALE_TMP_AGE
+        try:
+            dir_entries = list(os.scandir(self.disk_dir))
+        except OSError:
+            return entries, total
+        for entry in dir_entries:
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            if entry.name.endswith(TMP_SUFFIX):
+                if st.st_mtime < stale:
+                    try:
+                        os.unlink(entry.path)
+                    except OSError:
+                        pass
+                continue
+            if not entry.name.endswith(RAW_SUFFIX):
+                continue
+            entries.append((st.st_mtime_ns, st.st_size, entry.path))
+            total += st.st_size
+        return entries, total
+
+    def _disk_evict(self, keep):
+        # Remove least recently used entries until we're at the low-water
+        # mark, but never the entry at the path keep, which was just
+        # written.
+        entries, total = self._disk_scan()
+        entries.sort()
+        target = self.disk_limit * DISK_LOW_WATER
+        for _, size, path in entries:
+            if total <= target:
+                break
+            if path == keep:
+                continue
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+        self._disk_size = total
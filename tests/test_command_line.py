@@ -0,0 +1,66 @@
+import pytest
+from PIL import Image, ImageDraw
+
+from pdf_diff import command_line
+from pdf_diff.page_cache import PageImageCache
+
+
+@pytest.fixture
+def pdftopng_calls(monkeypatch):
+    calls = []
+
+    def pdftopng(pdffile, pagenumber, width):
+        calls.append((pdffile, pagenumber, width))
+        im = Image.new("RGBA", (width, width * 4 // 3), "white")
+        ImageDraw.Draw(im).rectangle((10, 10, width - 10, 40), fill="black")
+        return im
+
+    monkeypatch.setattr(command_line, "pdftopng", pdftopng)
+    return calls
+
+
+@pytest.fixture
+def pdfs(tmp_path):
+    fns = []
+    for i in (0, 1):
+        fn = tmp_path / ("%d.pdf" % i)
+        fn.write_bytes(b"%%PDF-1.4 document %d" % i)
+        fns.append(str(fn))
+    return fns
+
+
+def make_changes(pdfs):
+    # A change on page 1 of each document, as compute_changes would
+    # produce them.
+    changes = []
+    for i, fn in enumerate(pdfs):
+        changes.append({
+            "index": 0,
+            "pdf": {"index": i, "file": fn},
+            "page": {"number": 1, "width": 612.0, "height": 792.0},
+            "x": 72.0, "y": 72.0, "width": 100.0, "height": 12.0,
+            "text": "changed ",
+        })
+    return changes
+
+
+def test_rerender_with_disk_cache_runs_no_pdftoppm(tmp_path, pdfs,
+                                                   pdftopng_calls):
+    cache_dir = str(tmp_path / "cache")
+
+    cache = PageImageCache(disk_dir=cache_dir)
+    command_line.render_changes(make_changes(pdfs), ["strike", "underline"],
+                                200, cache)
+    assert len(pdftopng_calls) == 2
+
+    # A new cache instance, as in a second run of the command.
+    cache = PageImageCache(disk_dir=cache_dir)
+    command_line.render_changes(make_changes(pdfs), ["box", "box"],
+                                200, cache)
+    assert len(pdftopng_calls) == 2
+
+
+def test_no_cache_always_renders(pdfs, pdftopng_calls):
+    for _ in range(2):
+        command_line.render_changes(make_changes(pdfs), ["box", "box"], 200)
+    assert len(pdftopng_calls) == 4
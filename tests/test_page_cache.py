@@ -0,0 +1,264 @@
+import os
+
+import pytest
+from PIL import Image, ImageDraw
+
+from pdf_diff.page_cache import PageImageCache, image_nbytes
+
+WIDTH = 20
+HEIGHT = 30
+PAGE_NBYTES = WIDTH * HEIGHT * 4
+
+
+class StubRenderer:
+    """Stands in for pdftopng and records every call."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, pdffile, pagenumber, width):
+        self.calls.append((pdffile, pagenumber, width))
+        color = (pagenumber * 10 % 256, width % 256, 0, 255)
+        return Image.new("RGBA", (WIDTH, HEIGHT), color)
+
+
+@pytest.fixture
+def pdf(tmp_path):
+    fn = tmp_path / "a.pdf"
+    fn.write_bytes(b"%PDF-1.4 not really a pdf")
+    return str(fn)
+
+
+@pytest.fixture
+def render():
+    return StubRenderer()
+
+
+def raw_files(cache_dir):
+    return sorted(n for n in os.listdir(cache_dir) if n.endswith(".raw"))
+
+
+def test_memory_hit_does_not_render(pdf, render):
+    cache = PageImageCache()
+    first = cache.get(pdf, 1, 900, render)
+    second = cache.get(pdf, 1, 900, render)
+    assert len(render.calls) == 1
+    assert first.tobytes() == second.tobytes()
+
+
+def test_key_includes_page_and_width(pdf, render):
+    cache = PageImageCache()
+    cache.get(pdf, 1, 900, render)
+    cache.get(pdf, 2, 900, render)
+    cache.get(pdf, 1, 600, render)
+    assert len(render.calls) == 3
+
+
+def test_key_is_file_content(tmp_path, pdf, render):
+    cache = PageImageCache()
+    copy = tmp_path / "copy.pdf"
+    with open(pdf, "rb") as f:
+        copy.write_bytes(f.read())
+    cache.get(pdf, 1, 900, render)
+    cache.get(str(copy), 1, 900, render)
+    assert len(render.calls) == 1
+
+
+def test_changed_file_is_rendered_again(pdf, render):
+    cache = PageImageCache()
+    cache.get(pdf, 1, 900, render)
+    with open(pdf, "wb") as f:
+        f.write(b"%PDF-1.4 something else")
+    cache.get(pdf, 1, 900, render)
+    assert len(render.calls) == 2
+
+
+def test_disk_hit_in_new_instance(tmp_path, pdf, render):
+    cache_dir = str(tmp_path / "cache")
+    expected = PageImageCache(disk_dir=cache_dir).get(pdf, 3, 900, render)
+
+    im = PageImageCache(disk_dir=cache_dir).get(pdf, 3, 900, render)
+    assert len(render.calls) == 1
+    assert im.mode == expected.mode
+    assert im.size == expected.size
+    assert im.tobytes() == expected.tobytes()
+
+
+def test_disk_files_use_umask(tmp_path, pdf, render):
+    cache_dir = str(tmp_path / "cache")
+    old = os.umask(0o022)
+    try:
+        PageImageCache(disk_dir=cache_dir).get(pdf, 1, 900, render)
+    finally:
+        os.umask(old)
+    name = raw_files(cache_dir)[0]
+    assert os.stat(os.path.join(cache_dir, name)).st_mode & 0o777 == 0o644
+
+
+def test_memory_lru_eviction(pdf, render):
+    cache = PageImageCache(memory_limit=2 * PAGE_NBYTES)
+    cache.get(pdf, 1, 900, render)
+    cache.get(pdf, 2, 900, render)
+    cache.get(pdf, 1, 900, render)  # page 2 is now least recently used
+    cache.get(pdf, 3, 900, render)  # evicts page 2
+    assert len(render.calls) == 3
+
+    cache.get(pdf, 1, 900, render)
+    cache.get(pdf, 3, 900, render)
+    assert len(render.calls) == 3
+    cache.get(pdf, 2, 900, render)
+    assert len(render.calls) == 4
+
+
+def test_memory_skips_images_over_limit(pdf, render):
+    cache = PageImageCache(memory_limit=PAGE_NBYTES - 1)
+    cache.get(pdf, 1, 900, render)
+    cache.get(pdf, 1, 900, render)
+    assert len(render.calls) == 2
+
+
+def test_disk_lru_eviction(tmp_path, pdf, render):
+    cache_dir = str(tmp_path / "cache")
+    entry_size = PAGE_NBYTES + 16
+    cache = PageImageCache(memory_limit=0, disk_dir=cache_dir,
+                           disk_limit=4 * entry_size)
+    for page in (1, 2, 3, 4):
+        cache.get(pdf, page, 900, render)
+    # Age the entries in page order, then hit page 1 so that pages 2 and 3
+    # are the least recently used.
+    for page in (1, 2, 3, 4):
+        path = cache._disk_path((cache._hash(pdf), page, 900))
+        os.utime(path, ns=(page * 10**9, page * 10**9))
+    cache.get(pdf, 1, 900, render)
+    assert len(render.calls) == 4
+
+    # Going over the limit evicts down to the low-water mark, which
+    # removes two entries.
+    cache.get(pdf, 5, 900, render)
+    assert len(raw_files(cache_dir)) == 3
+
+    for page in (1, 4, 5):
+        cache.get(pdf, page, 900, render)
+    assert len(render.calls) == 5
+    cache.get(pdf, 2, 900, render)
+    cache.get(pdf, 3, 900, render)
+    assert len(render.calls) == 7
+
+
+def test_disk_rescans_only_over_limit(tmp_path, pdf, render, monkeypatch):
+    cache_dir = str(tmp_path / "cache")
+    cache = PageImageCache(memory_limit=0, disk_dir=cache_dir,
+                           disk_limit=10 * (PAGE_NBYTES + 16))
+    scans = []
+    scan = cache._disk_scan
+    monkeypatch.setattr(cache, "_disk_scan",
+                        lambda: scans.append(1) or scan())
+    for page in range(1, 11):
+        cache.get(pdf, page, 900, render)
+    assert scans == []
+    cache.get(pdf, 11, 900, render)
+    assert len(scans) == 1
+    # Eviction made room, so the next write doesn't rescan.
+    cache.get(pdf, 12, 900, render)
+    assert len(scans) == 1
+
+
+def test_disk_never_evicts_new_entry(tmp_path, pdf, render):
+    cache_dir = str(tmp_path / "cache")
+    cache = PageImageCache(memory_limit=0, disk_dir=cache_dir,
+                           disk_limit=PAGE_NBYTES + 16)
+    cache.get(pdf, 1, 900, render)
+    # Give the existing entry a timestamp in the future so that it would
+    # sort after the new one.
+    for name in raw_files(cache_dir):
+        os.utime(os.path.join(cache_dir, name), ns=(2**62, 2**62))
+    cache.get(pdf, 2, 900, render)
+    cache.get(pdf, 2, 900, render)
+    assert len(render.calls) == 2
+
+
+def test_disk_removes_stale_temp_files(tmp_path, pdf, render):
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    stale = cache_dir / "leftover.tmp"
+    stale.write_bytes(b"x" * 100)
+    os.utime(str(stale), (0, 0))
+    fresh = cache_dir / "inflight.tmp"
+    fresh.write_bytes(b"x" * 100)
+
+    PageImageCache(disk_dir=str(cache_dir))
+    assert not stale.exists()
+    assert fresh.exists()
+
+
+def test_disk_write_cleans_up_on_interrupt(tmp_path, pdf, render,
+                                          monkeypatch):
+    cache_dir = str(tmp_path / "cache")
+    cache = PageImageCache(disk_dir=cache_dir)
+
+    def interrupt(*args, **kwargs):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(os, "replace", interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        cache.get(pdf, 1, 900, render)
+    assert os.listdir(cache_dir) == []
+
+
+def test_unwritable_disk_dir_still_renders(tmp_path, pdf, render,
+                                           monkeypatch):
+    cache_dir = str(tmp_path / "cache")
+    cache = PageImageCache(disk_dir=cache_dir)
+
+    def denied(*args, **kwargs):
+        raise PermissionError("denied")
+
+    monkeypatch.setattr(os, "open", denied)
+    im = cache.get(pdf, 1, 900, render)
+    assert image_nbytes(im) == PAGE_NBYTES
+    assert os.listdir(cache_dir) == []
+
+
+def test_disk_dir_that_cannot_be_created(tmp_path, pdf, render):
+    not_a_dir = tmp_path / "file"
+    not_a_dir.write_bytes(b"")
+    cache = PageImageCache(disk_dir=str(not_a_dir / "cache"))
+    cache.get(pdf, 1, 900, render)
+    cache.get(pdf, 1, 900, render)
+    assert len(render.calls) == 1
+
+
+@pytest.mark.parametrize("corrupt", [
+    lambda data: data[:10],
+    lambda data: data[:-5],
+    lambda data: b"JUNK" + data[4:],
+])
+def test_corrupt_disk_entry_is_rendered_again(tmp_path, pdf, render, corrupt):
+    cache_dir = str(tmp_path / "cache")
+    PageImageCache(disk_dir=cache_dir).get(pdf, 1, 900, render)
+    path = os.path.join(cache_dir, raw_files(cache_dir)[0])
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(corrupt(data))
+
+    im = PageImageCache(disk_dir=cache_dir).get(pdf, 1, 900, render)
+    assert len(render.calls) == 2
+    assert image_nbytes(im) == PAGE_NBYTES
+
+    # The entry was rewritten, so a third instance hits it.
+    PageImageCache(disk_dir=cache_dir).get(pdf, 1, 900, render)
+    assert len(render.calls) == 2
+
+
+def test_drawing_on_result_does_not_change_cache(tmp_path, pdf, render):
+    cache = PageImageCache(disk_dir=str(tmp_path / "cache"))
+    im = cache.get(pdf, 1, 900, render)
+    original = im.tobytes()
+    ImageDraw.Draw(im).rectangle((0, 0, 10, 10), outline="red")
+    assert im.tobytes() != original
+
+    assert cache.get(pdf, 1, 900, render).tobytes() == original
+    cache.clear()
+    assert cache.get(pdf, 1, 900, render).tobytes() == original
+    assert len(render.calls) == 1